@@ -32,6 +32,7 @@
 
 import argparse
 import json
+import os
 import serial
 import smbus
 import sys
@@ -41,6 +42,11 @@ from autobahn import websocket
 from twisted.internet import reactor
 from twisted.python import log
 
+# The message validation shared with the hub lives in the directory above.
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir))
+import color_protocol
+
 
 class BroadcastServerProtocol(websocket.WebSocketServerProtocol):
 
@@ -137,7 +143,7 @@ def readI2CData(i2c_input, factory):
     # Check that data is formatted correctly.
     try:
       obj = validateData(hexrgb)
-    except ValueError, e:
+    except color_protocol.ValidationError, e:
       print e
     else:
       # Broadcast json data as string for websocket.
@@ -154,7 +160,7 @@ def readSerialData(serial_input, factory):
     # Check that data is formatted correctly.
     try:
       obj = validateData(data)
-    except ValueError, e:
+    except color_protocol.ValidationError, e:
       print e
     else:
       # Broadcast json data as string for websocket.
@@ -162,33 +168,7 @@ def readSerialData(serial_input, factory):
 
 
 # Validate the serial data.
-def validateData(data):
-  # Check that data is in proper json format.
-  try:
-    obj = json.loads(data)
-  except ValueError:
-    raise ValueError, "Invalid json data: " + data
-
-  # Check object is dictionary.
-  if not isinstance(obj, dict):
-    raise ValueError, "Object is not a dictionary"
-
-  # Validate desired keys in object.
-  keys = ('clear', 'red', 'green', 'blue')
-  missing_keys = []
-  for key in keys:
-    if key not in obj:
-      missing_keys.append(key)
-      
-  if missing_keys:
-    raise ValueError, "Missing keys: %s" % missing_keys
-
-  # Validate values of desired keys are integers.
-  for key, value in obj.iteritems():
-    if not isinstance(value, int):
-      raise ValueError, "Value for %s is not an integer: %s" % (key, value)
-  
-  return obj
+validateData = color_protocol.validateSensor
 
 
 # Get input arguments.
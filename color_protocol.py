@@ -0,0 +1,141 @@
+###############################################################################
+## Validation of the color messages passed between the Raspberry Pi, the hub
+## server and the webpage, shared by all of them.
+##
+## A message is a JSON dictionary of integer values, such as
+##   {"red": 255, "green": 128, "blue": 0, "clear": 1024, "id": "..."}
+## Schemas say which keys a message needs and the range each key's value
+## must be in. compileSchema() turns a schema into a validator up front, so
+## a valid message is checked in a single pass over its keys, and errors are
+## raised as a ValidationError carrying one of the codes below; the readable
+## message is only put together if the error is printed.
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+import json
+
+
+# Error codes.
+INVALID_JSON = 'invalid_json'
+NOT_A_DICT = 'not_a_dict'
+MISSING_KEYS = 'missing_keys'
+NOT_AN_INTEGER = 'not_an_integer'
+OUT_OF_RANGE = 'out_of_range'
+
+ERROR_MESSAGES = {
+  INVALID_JSON: 'Invalid json data: %(value)s',
+  NOT_A_DICT: 'Object is not a dictionary, but type %(value)s',
+  MISSING_KEYS: 'Missing keys: %(key)s',
+  NOT_AN_INTEGER: 'Value for %(key)s is not an integer: %(value)r',
+  OUT_OF_RANGE: 'Value for %(key)s is out of range: %(value)r',
+}
+
+# Range of values each key may have.
+VALUE_RANGES = {
+  'red': (0, 255),
+  'green': (0, 255),
+  'blue': (0, 255),
+  'clear': (0, 65535),
+  'votes': (0, 2 ** 31 - 1),
+}
+
+# Types JSON integers decode to. bool is a subclass of int, but true and
+# false are not colors.
+INTEGER_TYPES = (int, long)
+
+# Keys whose values are not integers and are passed through unchecked.
+PASSTHROUGH_KEYS = ('id', 'trace', 'sensors')
+
+
+class ValidationError(ValueError):
+  """
+  Raised for a message that does not match its schema. code is one of the
+  error codes, key the key at fault, if any, and value the value at fault.
+  """
+
+  def __init__(self, code, key=None, value=None):
+    ValueError.__init__(self, code, key)
+    self.code = code
+    self.key = key
+    self.value = value
+
+  def __str__(self):
+    return ERROR_MESSAGES[self.code] % {'key': self.key, 'value': self.value}
+
+
+# Compile a validator for messages that must have the required keys. Any
+# other key must be a passthrough key or an integer, in range if it has one.
+# The validator takes a JSON string and returns the decoded dictionary; its
+# check attribute validates an already decoded one.
+def compileSchema(required, ranges=VALUE_RANGES, passthrough=PASSTHROUGH_KEYS):
+  checks = tuple((key,) + ranges[key] for key in required)
+  requiredCount = len(required)
+  requiredKeys = frozenset(required)
+  passthroughKeys = frozenset(passthrough)
+  loads = json.loads
+
+  def check(obj):
+    if type(obj) is not dict:
+      raise ValidationError(NOT_A_DICT, value=type(obj))
+
+    # Fast path: every required key, in one pass.
+    for key, low, high in checks:
+      value = obj.get(key)
+      if type(value) is not int or not low <= value <= high:
+        _diagnose(obj, required, ranges)
+
+    # Only messages with more than the required keys need a second look.
+    if len(obj) != requiredCount:
+      for key, value in obj.iteritems():
+        if key in requiredKeys or key in passthroughKeys:
+          continue
+        if type(value) not in INTEGER_TYPES:
+          raise ValidationError(NOT_AN_INTEGER, key, value)
+        if key in ranges:
+          low, high = ranges[key]
+          if not low <= value <= high:
+            raise ValidationError(OUT_OF_RANGE, key, value)
+    return obj
+
+  def validate(data):
+    try:
+      obj = loads(data)
+    except ValueError:
+      raise ValidationError(INVALID_JSON, value=data)
+    return check(obj)
+
+  validate.check = check
+  return validate
+
+
+# Work out which error a message that failed the fast path has.
+def _diagnose(obj, required, ranges):
+  missing = [key for key in required if key not in obj]
+  if missing:
+    raise ValidationError(MISSING_KEYS, missing)
+  for key in required:
+    value = obj[key]
+    if type(value) not in INTEGER_TYPES:
+      raise ValidationError(NOT_AN_INTEGER, key, value)
+    low, high = ranges[key]
+    if not low <= value <= high:
+      raise ValidationError(OUT_OF_RANGE, key, value)
+
+
+# Colors sent to the LEDs and the webpage.
+validateColor = compileSchema(('red', 'green', 'blue'))
+
+# Raw readings from the color sensor.
+validateSensor = compileSchema(('clear', 'red', 'green', 'blue'))
@@ -0,0 +1,350 @@
+###############################################################################
+## Stand-ins for the hardware raspi_client.py talks to, so its pipeline can
+## run on a machine without a TCS34725 color sensor or an Arduino:
+## 1. SimulatedTCS34725 behaves like smbus.SMBus with the color sensor at
+##    address 0x29, following the register map and integration timing that
+##    openI2CBus() sets up.
+## 2. TraceRecordingBus wraps any bus and writes every color sample read from
+##    it to a trace file. TraceReplayBus plays such a trace back, optionally
+##    faster than real time.
+## 3. SimulatedTCA9548A stands in for an I2C multiplexer with a simulated
+##    sensor on each of its channels.
+## 4. FakeArduino opens a pseudo-terminal that can be handed to serial.Serial
+##    in place of /dev/ttyACM0, and decodes the frames written to it the same
+##    way serial_input_to_pwm_output.ino does.
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+import colorsys
+import errno
+import json
+import logging
+import os
+import pty
+import threading
+import time
+import tty
+
+
+# TCS34725 register map. Register addresses must be OR'ed with 0x80.
+TCS34725_ADDRESS = 0x29
+TCS34725_ID = 0x44
+COMMAND_BIT = 0x80
+ENABLE_REG = 0x00
+ATIME_REG = 0x01
+STATUS_REG = 0x13
+STATUS_AVALID = 0x01
+CONTROL_REG = 0x0F
+ID_REG = 0x12
+CDATA_REG = 0x14
+ENABLE_PON = 0x01
+ENABLE_AEN = 0x02
+GAINS = (1, 4, 16, 60)
+
+# Each integration cycle is 2.4 ms long.
+INTEGRATION_CYCLE = 0.0024
+
+
+# Clock running speed times faster than the wall clock, for driving the
+# simulated sensor at an accelerated rate.
+def acceleratedClock(speed):
+  start = time.time()
+  return lambda: start + (time.time() - start) * speed
+
+
+# Color source cycling through the hues, one full turn every period seconds,
+# starting phase of a turn in. Returns red, green and blue light levels
+# between 0 and 1.
+def hueCycleSource(period=10.0, phase=0.0):
+  def source(t):
+    return colorsys.hsv_to_rgb((t / period + phase) % 1.0, 0.8, 1.0)
+  return source
+
+
+class SimulatedTCS34725(object):
+  """
+  Simulated smbus.SMBus with a single TCS34725 color sensor attached.
+
+  A write with the command bit set selects a register, and the write after
+  it stores a value in that register, which is how openI2CBus() programs
+  the sensor. Color data only changes at the end of each integration window,
+  whose length is set by the RGBC timing register, so reading faster than the
+  sensor integrates returns repeated samples just as the real device does.
+
+  The AVALID bit of the status register is set when a new sample is latched.
+  Unlike on the real device, where it stays set, reading the data registers
+  clears it again, so a poller can tell a fresh sample from one it already
+  has.
+  """
+
+  def __init__(self, colorSource=None, address=TCS34725_ADDRESS,
+               clock=time.time, countsPerCycle=64):
+    self.address = address
+    self.colorSource = colorSource or hueCycleSource()
+    self.clock = clock
+    self.countsPerCycle = countsPerCycle
+    self.registers = [0] * 0x20
+    self.registers[ATIME_REG] = 0xFF
+    self.registers[ID_REG] = TCS34725_ID
+    self.pointer = 0
+    self.expectData = False
+    self.cycleStart = None
+    self.completedWindows = 0
+
+  def integrationTime(self):
+    return (256 - self.registers[ATIME_REG]) * INTEGRATION_CYCLE
+
+  def maxCount(self):
+    return min(65535, (256 - self.registers[ATIME_REG]) * 1024)
+
+  def write_byte(self, addr, value):
+    self._checkAddress(addr)
+    if self.expectData:
+      self.expectData = False
+      self._writeRegister(self.pointer, value)
+    elif value & COMMAND_BIT:
+      self.pointer = value & 0x1F
+      self.expectData = True
+
+  def read_byte(self, addr):
+    self._checkAddress(addr)
+    self.expectData = False
+    self._integrate()
+    return self.registers[self.pointer]
+
+  def read_i2c_block_data(self, addr, cmd):
+    self._checkAddress(addr)
+    self.write_byte(addr, cmd)
+    self.expectData = False
+    self._integrate()
+    data = []
+    for offset in range(32):
+      reg = self.pointer + offset
+      data.append(self.registers[reg] if reg < len(self.registers) else 0)
+    if self.pointer <= CDATA_REG < self.pointer + 32:
+      self.registers[STATUS_REG] &= ~STATUS_AVALID
+    return data
+
+  def _checkAddress(self, addr):
+    if addr != self.address:
+      # smbus reports a missing device as a remote I/O error.
+      raise IOError(errno.EREMOTEIO, 'No device at address 0x%02x' % addr)
+
+  def _writeRegister(self, reg, value):
+    # Status, ID and data registers are read-only.
+    if reg >= ID_REG:
+      return
+    self.registers[reg] = value & 0xFF
+    if reg in (ENABLE_REG, ATIME_REG):
+      enabled = ENABLE_PON | ENABLE_AEN
+      if self.registers[ENABLE_REG] & enabled == enabled:
+        self.cycleStart = self.clock()
+        self.completedWindows = 0
+      else:
+        self.cycleStart = None
+      self.registers[STATUS_REG] = 0
+
+  # Latch a new sample into the data registers if a window has completed.
+  def _integrate(self):
+    if self.cycleStart is None:
+      return
+    window = self.integrationTime()
+    windows = int((self.clock() - self.cycleStart) / window)
+    if windows <= self.completedWindows:
+      return
+    self.completedWindows = windows
+
+    levels = self.colorSource(self.cycleStart + windows * window)
+    scale = (GAINS[self.registers[CONTROL_REG] & 0x03] *
+             (256 - self.registers[ATIME_REG]) * self.countsPerCycle)
+    maxCount = self.maxCount()
+    red, green, blue = [min(maxCount, int(level * scale)) for level in levels]
+    clear = min(maxCount, red + green + blue)
+    for i, count in enumerate((clear, red, green, blue)):
+      self.registers[CDATA_REG + 2 * i] = count & 0xFF
+      self.registers[CDATA_REG + 2 * i + 1] = count >> 8
+    self.registers[STATUS_REG] |= STATUS_AVALID
+
+
+class SimulatedTCA9548A(object):
+  """
+  Simulated smbus.SMBus with a TCA9548A I2C multiplexer on it. Writing a
+  byte to the multiplexer's address connects the channels whose bits are
+  set, and other addresses reach the device on the lowest connected channel.
+  devices maps channel numbers to simulated devices.
+  """
+
+  def __init__(self, devices, address=0x70):
+    self.devices = devices
+    self.address = address
+    self.mask = 0
+
+  def _device(self, addr):
+    for channel in sorted(self.devices):
+      if self.mask & (1 << channel):
+        return self.devices[channel]
+    raise IOError(errno.EREMOTEIO, 'No device at address 0x%02x' % addr)
+
+  def write_byte(self, addr, value):
+    if addr == self.address:
+      self.mask = value & 0xFF
+    else:
+      self._device(addr).write_byte(addr, value)
+
+  def read_byte(self, addr):
+    if addr == self.address:
+      return self.mask
+    return self._device(addr).read_byte(addr)
+
+  def read_i2c_block_data(self, addr, cmd):
+    return self._device(addr).read_i2c_block_data(addr, cmd)
+
+
+class TraceRecordingBus(object):
+  """
+  Wraps an I2C bus and appends every block read to a trace file, one JSON
+  object per line with the seconds since the first read and the data bytes.
+  """
+
+  def __init__(self, bus, path):
+    self.bus = bus
+    self.trace = open(path, 'w')
+    self.start = None
+    self.lock = threading.Lock()
+
+  def write_byte(self, addr, value):
+    return self.bus.write_byte(addr, value)
+
+  def read_byte(self, addr):
+    return self.bus.read_byte(addr)
+
+  def read_i2c_block_data(self, addr, cmd):
+    data = self.bus.read_i2c_block_data(addr, cmd)
+    now = time.time()
+    with self.lock:
+      if self.start is None:
+        self.start = now
+      self.trace.write(json.dumps({'t': round(now - self.start, 6),
+                                   'addr': addr,
+                                   'data': data[:8]}) + '\n')
+      self.trace.flush()
+    return data
+
+  def close(self):
+    self.trace.close()
+
+
+class TraceReplayBus(object):
+  """
+  Plays back a trace written by TraceRecordingBus. Each block read blocks
+  until the sample is due, speed times faster than it was recorded. Once the
+  trace runs out, finished is set and reads fail with IOError, unless loop is
+  set in which case it starts over.
+  """
+
+  def __init__(self, path, speed=1.0, loop=False):
+    with open(path) as trace:
+      self.samples = [json.loads(line) for line in trace if line.strip()]
+    if not self.samples:
+      raise ValueError, "Trace file %s has no samples" % path
+    self.speed = speed
+    self.loop = loop
+    self.index = 0
+    self.start = None
+    self.finished = threading.Event()
+
+  def write_byte(self, addr, value):
+    pass
+
+  def read_byte(self, addr):
+    # Only the device version is read byte by byte.
+    return TCS34725_ID
+
+  def read_i2c_block_data(self, addr, cmd):
+    if self.index >= len(self.samples):
+      if not self.loop:
+        self.finished.set()
+        raise IOError(errno.EIO, 'End of trace')
+      self.index = 0
+      self.start = None
+
+    sample = self.samples[self.index]
+    self.index += 1
+    now = time.time()
+    if self.start is None:
+      self.start = now - sample['t'] / self.speed
+    delay = self.start + sample['t'] / self.speed - now
+    if delay > 0:
+      time.sleep(delay)
+    return sample['data'] + [0] * (32 - len(sample['data']))
+
+
+class FakeArduino(object):
+  """
+  Pseudo-terminal standing in for the Arduino. Open port with serial.Serial
+  and every complete 0xFF 0xFE red green blue 0x00 frame written to it is
+  decoded and appended to frames as (receive time, (red, green, blue)).
+  """
+
+  START, HEADER_1, HEADER_2, COLOR_R, COLOR_G, COLOR_B = range(6)
+
+  def __init__(self, onFrame=None):
+    self.master, self.slave = pty.openpty()
+    tty.setraw(self.slave)
+    self.port = os.ttyname(self.slave)
+    self.onFrame = onFrame
+    self.frames = []
+    self.color = [0, 0, 0]
+    self.state = self.START
+    self.thread = None
+
+  def start(self):
+    self.thread = threading.Thread(target=self._readLoop)
+    self.thread.daemon = True
+    self.thread.start()
+    logging.info('Fake Arduino listening on %s' % self.port)
+
+  def _readLoop(self):
+    while True:
+      try:
+        data = os.read(self.master, 1024)
+      except OSError:
+        return
+      if not data:
+        return
+      self.feed(data, time.time())
+
+  # Run bytes through the same state machine as the Arduino sketch.
+  def feed(self, data, now):
+    for byte in bytearray(data):
+      if self.state == self.START:
+        if byte == 0xFF:
+          self.state = self.HEADER_1
+      elif self.state == self.HEADER_1:
+        self.state = self.HEADER_2 if byte == 0xFE else self.START
+      elif self.state in (self.HEADER_2, self.COLOR_R, self.COLOR_G):
+        self.color[self.state - self.HEADER_2] = byte
+        self.state += 1
+      else:
+        if byte == 0x00:
+          color = tuple(self.color)
+          self.frames.append((now, color))
+          if self.onFrame is not None:
+            self.onFrame(now, color)
+        self.state = self.START
+
+  def close(self):
+    os.close(self.slave)
+    os.close(self.master)
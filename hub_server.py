@@ -36,12 +36,18 @@
 ##
 ###############################################################################
 
-# TODO: Make script to handle voting model. Import it here.
+import argparse
+import color_protocol
 import json
+import latency_trace
+import static_site
 import sys
+import vote_histogram
 from autobahn import websocket
+from autobahn.resource import WebSocketResource, HTTPChannelHixie76Aware
 from twisted.internet import reactor
 from twisted.python import log
+from twisted.web.server import Site
 
 
 class BroadcastServerProtocol(websocket.WebSocketServerProtocol):
@@ -51,11 +57,13 @@ class BroadcastServerProtocol(websocket.WebSocketServerProtocol):
 
   def onMessage(self, msg, binary):
      if not binary:
+        received_at = latency_trace.now()
+
         # Validate that the message data is proper JSON dictionary with desired
         # keys.
         try:
           msg = validateData(msg)
-        except ValueError, e:
+        except color_protocol.ValidationError, e:
           print e
           return
 
@@ -67,6 +75,7 @@ class BroadcastServerProtocol(websocket.WebSocketServerProtocol):
         # The LEDs will be directly controlled by Raspberry Pi.
         if is_sensor:
           print "data from sensor"
+          latency_trace.stamp(msg, 'hub_receive', received_at)
           outputMsg = msg
 
         # If the message is from an audience member, add it to the
@@ -74,13 +83,22 @@ class BroadcastServerProtocol(websocket.WebSocketServerProtocol):
         # and send it to the webpage. Send it to Raspberry Pi to turn on LEDs,
         # if the model sets the dress control mode to audience.
         else:
+          self.factory.model.vote(self.peerstr, msg['red'], msg['green'],
+                                  msg['blue'])
+
           # Output the updated voting model from self.factory.model.
           outputMsg = tallyVotes(self.factory.model)
+          if outputMsg is None:
+            return
+          self.factory.decidedColor = dict(outputMsg)
+          latency_trace.startTrace(outputMsg, 'hub', 'hub_receive', received_at)
+          latency_trace.stamp(outputMsg, 'tally')
 
         # Display decided upon color.
         print "'%s' from %s" % (outputMsg, self.peerstr)
 
         # Broadcast data as json string for websocket.
+        latency_trace.stamp(outputMsg, 'broadcast')
         self.factory.broadcast(json.dumps(outputMsg))
 
   def connectionLost(self, reason):
@@ -96,12 +114,13 @@ class BroadcastServerFactory(websocket.WebSocketServerFactory):
   """
 
   def __init__(self, url, voteModel, debug = False, debugCodePaths = False):
-     websocket.WebSocketServerFactory.__init__(self, url, voteModel,
-                                     debug=debug, debugCodePaths=debugCodePaths)
+     websocket.WebSocketServerFactory.__init__(self, url, debug=debug,
+                                               debugCodePaths=debugCodePaths)
      self.clients = []
      self.tickcount = 0
      self.tick()
      self.model = voteModel
+     self.decidedColor = dict(NO_VOTES_COLOR)
 
   def tick(self):
      self.tickcount += 1
@@ -117,6 +136,18 @@ class BroadcastServerFactory(websocket.WebSocketServerFactory):
      if client in self.clients:
         print "unregistered client " + client.peerstr
         self.clients.remove(client)
+     # Votes only count while the audience member is connected, so the
+     # decided color can change when one leaves.
+     self.model.removeVoter(client.peerstr)
+     outputMsg = tallyVotes(self.model)
+     if outputMsg is None:
+        outputMsg = dict(NO_VOTES_COLOR)
+     if outputMsg == self.decidedColor:
+        return
+     self.decidedColor = dict(outputMsg)
+     latency_trace.startTrace(outputMsg, 'hub', 'tally')
+     latency_trace.stamp(outputMsg, 'broadcast')
+     self.broadcast(json.dumps(outputMsg))
 
   def broadcast(self, msg):
      print "broadcasting message '%s' .." % msg
@@ -125,43 +156,35 @@ class BroadcastServerFactory(websocket.WebSocketServerFactory):
         print "message sent to " + c.peerstr
 
 
-# TODO: Tally up votes.
+# Color sent once the last vote is taken back, which turns the LEDs off.
+NO_VOTES_COLOR = {
+  'red': 0,
+  'green': 0,
+  'blue': 0,
+  'votes': 0
+}
+
+
+# Tally up votes. The decided color is the most voted for color, not the
+# average of the votes. Returns None if nobody has voted.
 def tallyVotes(dataModel):
-  # TODO: figure out voting scheme.
-  decidedColorModel = dataModel
-  
+  mode = dataModel.mode()
+  if mode is None:
+    return None
+
+  red, green, blue, votes = mode
+  decidedColorModel = {
+    'red': red,
+    'green': green,
+    'blue': blue,
+    'votes': votes
+  }
+
   return decidedColorModel
 
 
 # Determine if the data is valid json with the needed keys and value format.
-def validateData(data):
-  # Check that data is in proper json format.
-  try:
-    obj = json.loads(data)
-  except ValueError:
-    raise ValueError, "Invalid json data: " + data
-  
-  # Check object is dictionary.
-  if not isinstance(obj, dict):
-    raise ValueError, "Object is not a dictionary"
-
-  # Validate desired keys in object.
-  keys = ('red', 'green', 'blue')
-  missing_keys = []
-  for key in keys:
-    if key not in obj:
-      missing_keys.append(key)
-
-  if missing_keys:
-    raise ValueError, "Missing keys: %s" % missing_keys
-
-  # Validate values of desired keys are integers.
-  for key, value in obj.iteritems():
-    if key != 'id':
-      if not isinstance(value, int):
-        raise ValueError, "Value for %s is not an integer: %s" % (key, value)
-
-  return obj
+validateData = color_protocol.validateColor
 
 
 # Determine if data is from the sensor as oppose to the audience.
@@ -176,20 +199,52 @@ def authenticateSensor(msg):
   return is_sensor
 
 
+# Get input arguments.
+def getArguments():
+  # Enable parsing of arguments for this script.
+  parser = argparse.ArgumentParser(description=
+                      'Set settings for running this script.')
+  parser.add_argument('-p', '--port_number', type=int,
+                      default=9000,
+                      help='port number of server (default: 9000)')
+  parser.add_argument('-w', '--website_dir',
+                      help='also serve the audience webpage from this directory, e.g. nunway_website (default: websocket only)')
+  parser.add_argument('--latency_dump',
+                      default='hub_latency.trace',
+                      help='file the latency trace is written to on SIGUSR1 (default: hub_latency.trace)')
+  args = parser.parse_args()
+
+  return args
+
+
 def main():
   # Add fancy time logging.
   log.startLogging(sys.stdout)
 
+  args = getArguments()
+
+  # Write the latency trace to a file on SIGUSR1.
+  latency_trace.installDumpHandler(args.latency_dump)
+
   # Instantiate voting model.
-  # TODO: Make separate Python script for handling the voting.
-  #       Then import that script into this script.
-  model = []
+  model = vote_histogram.ColorHistogram()
 
   # Listen to all addresses on port 9000.
-  factory = BroadcastServerFactory("ws://[::]:9000", voteModel = model,
-                                    debug = False)
+  factory = BroadcastServerFactory("ws://[::]:%d" % args.port_number,
+                                    voteModel = model, debug = False)
   factory.protocol = BroadcastServerProtocol
-  websocket.listenWS(factory)
+
+  # Serve the webpage and the websocket on the same port, or just the
+  # websocket.
+  if args.website_dir:
+    factory.setProtocolOptions(allowHixie76 = True)
+    root = static_site.StaticSite(args.website_dir,
+                                  wsResource = WebSocketResource(factory))
+    site = Site(root)
+    site.protocol = HTTPChannelHixie76Aware
+    reactor.listenTCP(args.port_number, site)
+  else:
+    websocket.listenWS(factory)
 
   # Start handling requests across websocket.
   reactor.run()
@@ -0,0 +1,115 @@
+###############################################################################
+## Reports per-stage latency percentiles from latency trace dumps. Give it the
+## files dumped by the hub, the Raspberry Pi and the browsers; entries are
+## joined on their origin and sequence number, and the time between each
+## stage and the stage before it is summarised. After the broadcast the
+## pipeline splits, so the LED path to serial_write and the browser path to
+## browser_paint each get their own end-to-end row.
+##
+## Example:
+##   kill -USR1 <hub pid> <raspi_client pid>
+##   python latency_report.py hub_latency.trace raspi_latency.trace
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+import argparse
+import collections
+from latency_trace import LEAF_STAGES, STAGE_INDEX, STAGE_PREDECESSOR
+
+
+# Read trace dumps into {(origin, seq): {stage: [timestamps]}}.
+def readTraces(paths):
+  traces = collections.defaultdict(lambda: collections.defaultdict(list))
+  for path in paths:
+    with open(path) as dump:
+      for line in dump:
+        if not line.strip() or line.startswith('#'):
+          continue
+        origin, seq, stage, timestamp = line.rsplit(None, 3)
+        if stage not in STAGE_INDEX:
+          continue
+        traces[(origin, int(seq))][stage].append(int(float(timestamp)))
+  return traces
+
+
+# The stages a message passed on its way to stage, nearest first. Stages it
+# skipped, such as the tally for a sensor reading, are left out.
+def recordedPredecessors(stage, stages):
+  chain = []
+  stage = STAGE_PREDECESSOR[stage]
+  while stage is not None:
+    if stage in stages:
+      chain.append(stage)
+    stage = STAGE_PREDECESSOR[stage]
+  return chain
+
+
+# Collect the latency of every stage from the recorded stage it follows, and
+# of each leaf stage from the start of the message, in milliseconds. A stage
+# can be recorded more than once for a message, for example by several
+# browsers, so each time is measured from the latest earlier time of the
+# stage before.
+def stageLatencies(traces):
+  latencies = collections.defaultdict(list)
+  for stages in traces.values():
+    for stage, timestamps in stages.items():
+      chain = recordedPredecessors(stage, stages)
+      if not chain:
+        continue
+      previous = chain[0]
+      for timestamp in timestamps:
+        earlier = [t for t in stages[previous] if t <= timestamp]
+        if earlier:
+          latencies[(previous, stage)].append((timestamp - max(earlier)) /
+                                              1000.0)
+      # A leaf only a single stage away already has its row.
+      if stage in LEAF_STAGES and len(chain) > 1:
+        first = min(stages[chain[-1]])
+        for timestamp in timestamps:
+          latencies[(chain[-1], stage)].append((timestamp - first) / 1000.0)
+  return latencies
+
+
+def percentile(values, fraction):
+  return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def printReport(latencies):
+  print '%-34s %7s %9s %9s %9s %9s' % ('stage (ms)', 'count', 'p50', 'p90',
+                                       'p99', 'max')
+  for key in sorted(latencies, key=lambda k: (STAGE_INDEX[k[1]],
+                                              -STAGE_INDEX[k[0]])):
+    values = sorted(latencies[key])
+    print '%-34s %7d %9.2f %9.2f %9.2f %9.2f' % (
+        '%s -> %s' % key, len(values), percentile(values, 0.5),
+        percentile(values, 0.9), percentile(values, 0.99), values[-1])
+
+
+# Get input arguments.
+def getArguments():
+  parser = argparse.ArgumentParser(description=
+                      'Report per-stage latency from latency trace dumps.')
+  parser.add_argument('dumps', nargs='+',
+                      help='latency trace files dumped by the hub, the Raspberry Pi and browsers')
+  return parser.parse_args()
+
+
+def main():
+  args = getArguments()
+  printReport(stageLatencies(readTraces(args.dumps)))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,168 @@
+###############################################################################
+## Latency tracing for the sensor to LED and browser pipeline.
+##
+## A color message carries a 'trace' entry holding where it started (origin),
+## a sequence number counting up from 1 for that origin, and the time in
+## microseconds at which it passed each stage. Each process also records the
+## stages it stamps in a fixed size ring buffer, which is written to a file
+## when the process gets SIGUSR1. latency_report.py joins the files from the
+## hub, the Pi and the browser and reports how long each stage takes.
+##
+## Timestamps are wall clock times, since stages run on different machines
+## whose clocks are kept in step with NTP.
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+import array
+import itertools
+import logging
+import signal
+import threading
+import time
+
+
+# Pipeline stages, in the order a message passes through them.
+STAGES = ('sample', 'uplink_enqueue', 'hub_receive', 'tally', 'broadcast',
+          'pi_receive', 'serial_write', 'browser_receive', 'browser_paint')
+STAGE_INDEX = dict((stage, i) for i, stage in enumerate(STAGES))
+
+# The stage each stage follows. After the broadcast the pipeline splits into
+# the Pi driving the LEDs and the browsers painting the page.
+STAGE_PREDECESSOR = {
+  'sample': None,
+  'uplink_enqueue': 'sample',
+  'hub_receive': 'uplink_enqueue',
+  'tally': 'hub_receive',
+  'broadcast': 'tally',
+  'pi_receive': 'broadcast',
+  'serial_write': 'pi_receive',
+  'browser_receive': 'broadcast',
+  'browser_paint': 'browser_receive',
+}
+
+# Stages no other stage follows, where a message's trip ends.
+LEAF_STAGES = tuple(stage for stage in STAGES
+                    if stage not in STAGE_PREDECESSOR.values())
+
+_sequence = itertools.count(1)
+
+
+# Current time in microseconds.
+def now():
+  return int(time.time() * 1000000)
+
+
+class TraceBuffer(object):
+  """
+  Ring buffer of the last capacity stage timestamps recorded by this process.
+  Entries are stored in preallocated arrays, so recording one allocates
+  nothing and the buffer never grows.
+
+  dump() must not be called from a signal handler, which could interrupt
+  add() on the same thread halfway through an entry; installDumpHandler()
+  hands the dump to a thread of its own instead.
+  """
+
+  def __init__(self, capacity=65536):
+    self.capacity = capacity
+    self.origins = [None] * capacity
+    self.seqs = array.array('l', [0]) * capacity
+    self.stages = array.array('B', [0]) * capacity
+    self.times = array.array('d', [0]) * capacity
+    self.count = 0
+    self.lock = threading.Lock()
+
+  def add(self, origin, seq, stage, timestamp):
+    with self.lock:
+      i = self.count % self.capacity
+      self.origins[i] = origin
+      self.seqs[i] = seq
+      self.stages[i] = STAGE_INDEX[stage]
+      self.times[i] = timestamp
+      self.count += 1
+
+  # Write the buffered entries, oldest first, one per line. Only copying
+  # them is done under the lock; formatting and writing happen outside it.
+  def dump(self, path):
+    with self.lock:
+      count = self.count
+      origins = list(self.origins)
+      seqs = self.seqs[:]
+      stages = self.stages[:]
+      times = self.times[:]
+    entries = []
+    for n in range(max(0, count - self.capacity), count):
+      i = n % self.capacity
+      entries.append('%s %d %s %d\n' % (origins[i], seqs[i],
+                                        STAGES[stages[i]], times[i]))
+    with open(path, 'w') as dump:
+      dump.write('# origin seq stage timestamp_us\n')
+      dump.writelines(entries)
+    return len(entries)
+
+
+buffer = TraceBuffer()
+
+
+# Record that the traced message reached stage.
+def recordStage(trace, stage, timestamp=None):
+  if timestamp is None:
+    timestamp = now()
+  trace['ts'][stage] = timestamp
+  buffer.add(trace['origin'], trace['seq'], stage, timestamp)
+
+
+# Start tracing a message at its first stage.
+def startTrace(msg, origin, stage, timestamp=None):
+  if not isinstance(msg, dict):
+    return
+  msg['trace'] = {'origin': origin, 'seq': next(_sequence), 'ts': {}}
+  recordStage(msg['trace'], stage, timestamp)
+
+
+# Record a stage for a message, if it is being traced.
+def stamp(msg, stage, timestamp=None):
+  if not isinstance(msg, dict):
+    return
+  trace = msg.get('trace')
+  if (isinstance(trace, dict) and isinstance(trace.get('seq'), int) and
+      isinstance(trace.get('ts'), dict) and 'origin' in trace):
+    recordStage(trace, stage, timestamp)
+
+
+# Dump the ring buffer to path whenever the process gets signum. The signal
+# handler only wakes a dump thread, which waits for any add() in progress to
+# finish. Must be called from the main thread.
+def installDumpHandler(path, signum=signal.SIGUSR1):
+  requested = threading.Event()
+
+  def dumpLoop():
+    while True:
+      requested.wait()
+      requested.clear()
+      try:
+        entries = buffer.dump(path)
+      except IOError, e:
+        logging.error('Could not write latency trace to %s: %s' % (path, e))
+        continue
+      logging.warning('Wrote %d latency trace entries to %s' % (entries, path))
+
+  thread = threading.Thread(target=dumpLoop)
+  thread.daemon = True
+  thread.start()
+
+  def handler(signum, frame):
+    requested.set()
+  signal.signal(signum, handler)
@@ -0,0 +1,134 @@
+###############################################################################
+## Renders the LED color on the Raspberry Pi at a fixed frame rate. New colors
+## from the hub or the sensor only set the target, and each frame eases the
+## LEDs a step closer to it, so the light changes smoothly no matter how
+## often, or how unevenly, the network delivers colors.
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+import latency_trace
+import logging
+import math
+import threading
+import time
+
+
+# Bytes in one frame to the Arduino: 0xFF 0xFE red green blue 0x00.
+FRAME_SIZE = 6
+
+# Easing weights are fixed point, with 1.0 stored as 1 << EASING_BITS.
+EASING_BITS = 8
+
+
+# Highest frame rate the serial link to the Arduino can carry, with each byte
+# taking a start bit, eight data bits and a stop bit.
+def maxFrameRate(baudrate):
+  return baudrate / 10.0 / FRAME_SIZE
+
+
+# Smoothstep easing: starts and ends slowly, fastest in the middle.
+def smoothstep(x):
+  return x * x * (3 - 2 * x)
+
+
+class LedRenderer(object):
+  """
+  Eases the LED color towards the latest target at a fixed frame rate.
+
+  Easing weights and gamma correction come from tables computed up front,
+  and every frame is written into the same buffer, so rendering a frame does
+  no floating point math and allocates nothing. Frames are only written
+  while a transition is in progress.
+  """
+
+  def __init__(self, writeFrame, fps=100, transitionTime=0.25, gamma=1.0):
+    self.writeFrame = writeFrame
+    self.frameInterval = 1.0 / fps
+    self.steps = max(1, int(round(transitionTime * fps)))
+    one = 1 << EASING_BITS
+    self.easingTable = [int(round(one * smoothstep(float(i) / self.steps)))
+                        for i in range(self.steps + 1)]
+    self.gammaTable = [int(round(255 * math.pow(i / 255.0, gamma)))
+                       for i in range(256)]
+    self.frame = bytearray(b'\xFF\xFE\x00\x00\x00\x00')
+    self.start = [0, 0, 0]
+    self.current = [0, 0, 0]
+    self.target = [0, 0, 0]
+    self.step = self.steps + 1
+    self.pendingTrace = None
+    self.lock = threading.Lock()
+    self.running = False
+
+  # Start a transition from the color shown now to the given one. If the color
+  # came in a traced message, its serial_write stage is recorded when the
+  # first frame of the transition is written. Values are clamped to 0-255 so
+  # they always index the gamma table.
+  def setTarget(self, red, green, blue, trace=None):
+    red = min(255, max(0, int(red)))
+    green = min(255, max(0, int(green)))
+    blue = min(255, max(0, int(blue)))
+    with self.lock:
+      start = self.start
+      current = self.current
+      target = self.target
+      start[0], start[1], start[2] = current[0], current[1], current[2]
+      target[0], target[1], target[2] = red, green, blue
+      self.step = 1
+      self.pendingTrace = trace
+
+  # Render and write the next frame. Returns False if there was nothing to do.
+  def renderFrame(self):
+    with self.lock:
+      if self.step > self.steps:
+        return False
+      weight = self.easingTable[self.step]
+      self.step += 1
+      start = self.start
+      current = self.current
+      target = self.target
+      frame = self.frame
+      gammaTable = self.gammaTable
+      for i in (0, 1, 2):
+        current[i] = start[i] + (((target[i] - start[i]) * weight) >>
+                                 EASING_BITS)
+        frame[2 + i] = gammaTable[current[i]]
+      trace = self.pendingTrace
+      self.pendingTrace = None
+    self.writeFrame(frame)
+    if trace is not None:
+      latency_trace.stamp({'trace': trace}, 'serial_write')
+    return True
+
+  # Render frames until stop() is called, keeping to the frame rate even if
+  # writing a frame takes a varying amount of time. A frame that fails is
+  # logged and skipped, so the LEDs never stop updating.
+  def run(self):
+    self.running = True
+    deadline = time.time()
+    while self.running:
+      try:
+        self.renderFrame()
+      except Exception:
+        logging.exception('Could not render LED frame')
+      deadline += self.frameInterval
+      delay = deadline - time.time()
+      if delay > 0:
+        time.sleep(delay)
+      elif delay < -self.frameInterval:
+        logging.warning('LED renderer fell %.1f ms behind' % (-delay * 1000))
+        deadline = time.time()
+
+  def stop(self):
+    self.running = False
@@ -1,8 +1,40 @@
-// Websocket endpoint for hub server.
+// Websocket endpoint for hub server. When the hub serves this page itself,
+// it marks the page with a hub-served meta tag and the websocket is on the
+// same host and port as the page; anywhere else, use the hub on EC2.
 var wsuri = "ws://ec2-54-200-22-181.us-west-2.compute.amazonaws.com:9000";
+if (document.querySelector('meta[name="hub-served"]')) {
+  var wsScheme = window.location.protocol == "https:" ? "wss://" : "ws://";
+  wsuri = wsScheme + window.location.host;
+}
 
 var sock = null;
 
+// Latency trace of the last color messages, in the same format the hub and
+// the Raspberry Pi dump theirs in. Call dumpLatencyTrace() from the browser
+// console to save it for latency_report.py.
+var traceCapacity = 4096;
+var traceEntries = [];
+var traceCount = 0;
+
+function recordStage(trace, stage, timestamp) {
+  traceEntries[traceCount % traceCapacity] =
+      trace.origin + " " + trace.seq + " " + stage + " " + timestamp;
+  traceCount++;
+}
+
+function dumpLatencyTrace() {
+  var first = Math.max(0, traceCount - traceCapacity);
+  var lines = ["# origin seq stage timestamp_us"];
+  for (var n = first; n < traceCount; n++) {
+    lines.push(traceEntries[n % traceCapacity]);
+  }
+  var link = document.createElement("a");
+  link.href = URL.createObjectURL(new Blob([lines.join("\n") + "\n"],
+                                           {type: "text/plain"}));
+  link.download = "browser_latency.trace";
+  link.click();
+}
+
 window.onload = function() {
   console.log("loaded");
   sock = new WebSocket(wsuri);
@@ -23,7 +55,15 @@ window.onload = function() {
     console.log("message received: " + e.data);
     //$("#colorTxt").text(e.data);
 
+    var receivedAt = Date.now() * 1000;
     var obj = JSON.parse(e.data);
     $("body").css('background-color', "rgb(" + obj.red + ", " + obj.green + ", " + obj.blue + ")");
+
+    if (obj.trace) {
+      recordStage(obj.trace, "browser_receive", receivedAt);
+      window.requestAnimationFrame(function() {
+        recordStage(obj.trace, "browser_paint", Date.now() * 1000);
+      });
+    }
   };
 };
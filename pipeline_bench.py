@@ -0,0 +1,249 @@
+###############################################################################
+## Measures the throughput and latency of raspi_client.py's pipeline from a
+## color sensor read to the LED frame arriving at the Arduino, without any
+## hardware. Samples come from a simulated sensor or a recorded trace, played
+## back at an accelerated speed, and the frames are decoded by a fake Arduino
+## on a pseudo-terminal.
+##
+## By default each sample goes through the hub's and the Pi's message
+## handling in process, and the LEDs are driven by the fixed-rate renderer,
+## as raspi_client.py does. Time spent on the network is not included.
+##
+## Example:
+##   python pipeline_bench.py --trace_file show.trace --replay_speed 20
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+import argparse
+import collections
+import hardware_backends
+import hub_server
+import json
+import latency_trace
+import led_renderer
+import logging
+import raspi_client
+import serial
+import threading
+import time
+
+
+# Id the hub recognises the Raspberry Pi's sensor data by.
+SENSOR_ID = '5a2649734c55285b24777e427e'
+
+# How often to check the simulated sensor for a new sample, in seconds.
+SAMPLE_POLL_INTERVAL = 0.0005
+
+
+class FreshSampleBus(object):
+  """
+  Wraps the color sensor bus and counts the samples read from it. With
+  waitForSample set, each block read first waits until the sensor sets
+  AVALID for a new integration window, so readI2CData() reads every sample
+  once instead of re-reading the one already latched.
+  """
+
+  def __init__(self, bus, waitForSample):
+    self.bus = bus
+    self.waitForSample = waitForSample
+    self.reads = 0
+
+  def write_byte(self, addr, value):
+    return self.bus.write_byte(addr, value)
+
+  def read_byte(self, addr):
+    return self.bus.read_byte(addr)
+
+  def read_i2c_block_data(self, addr, cmd):
+    if self.waitForSample:
+      while True:
+        self.bus.write_byte(addr, hardware_backends.COMMAND_BIT |
+                                  hardware_backends.STATUS_REG)
+        if self.bus.read_byte(addr) & hardware_backends.STATUS_AVALID:
+          break
+        time.sleep(SAMPLE_POLL_INTERVAL)
+      self.bus.write_byte(addr, hardware_backends.COMMAND_BIT |
+                                hardware_backends.CDATA_REG)
+    data = self.bus.read_i2c_block_data(addr, cmd)
+    self.reads += 1
+    return data
+
+
+class FrameMatcher(object):
+  """
+  Pairs the frames the fake Arduino decodes with the samples they show, by
+  color. A sample still waiting when a later sample's frame arrives never
+  made it to the LEDs, because its frame was lost or the renderer moved on
+  to a newer color first, and is counted as dropped.
+  """
+
+  def __init__(self):
+    self.pending = collections.deque()
+    self.latencies = []
+    self.dropped = 0
+    self.lock = threading.Lock()
+
+  def addSample(self, sampledAt, color):
+    with self.lock:
+      self.pending.append((sampledAt, color))
+
+  def onFrame(self, now, color):
+    with self.lock:
+      for i, (sampledAt, expected) in enumerate(self.pending):
+        if expected == color:
+          break
+      else:
+        return
+      for _ in range(i):
+        self.pending.popleft()
+        self.dropped += 1
+      self.pending.popleft()
+      self.latencies.append(now - sampledAt)
+
+
+class BenchFactory(object):
+  """
+  Takes the place of DataClientFactory. Each sample is registered with the
+  matcher, then either handed to the Arduino directly as
+  DataClientFactory.broadcast() does, or sent through the hub's handling in
+  BroadcastServerProtocol.onMessage() and back through
+  DataClientProtocol.onMessage(), serialized, validated and stamped on the
+  way as it would be over the websockets.
+  """
+
+  def __init__(self, matcher, throughHub):
+    self.matcher = matcher
+    self.throughHub = throughHub
+
+  def broadcast(self, msg):
+    self.matcher.addSample(msg['trace']['ts']['sample'] / 1000000.0,
+                           (msg['red'], msg['green'], msg['blue']))
+    latency_trace.stamp(msg, 'uplink_enqueue')
+    if not self.throughHub:
+      raspi_client.sendDataToArduino(msg)
+      return
+
+    received_at = latency_trace.now()
+    msg = hub_server.validateData(json.dumps(msg))
+    if not hub_server.authenticateSensor(msg):
+      return
+    latency_trace.stamp(msg, 'hub_receive', received_at)
+    latency_trace.stamp(msg, 'broadcast')
+
+    msg = raspi_client.validateData(json.dumps(msg))
+    latency_trace.stamp(msg, 'pi_receive')
+    raspi_client.sendDataToArduino(msg)
+
+
+def percentile(values, fraction):
+  if not values:
+    return 0.0
+  values = sorted(values)
+  return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+# Get input arguments.
+def getArguments():
+  parser = argparse.ArgumentParser(description=
+                      'Benchmark the sensor to LED pipeline without hardware.')
+  parser.add_argument('--trace_file',
+                      help='sensor trace to replay (default: use the simulated sensor)')
+  parser.add_argument('--replay_speed', type=float,
+                      default=10.0,
+                      help='how many times faster than real time to run the sensor (default: 10)')
+  parser.add_argument('--duration', type=float,
+                      default=5.0,
+                      help='seconds to run for when using the simulated sensor (default: 5)')
+  parser.add_argument('--poll_interval', type=float,
+                      default=0.0,
+                      help='seconds readI2CData waits between reads (default: 0)')
+  parser.add_argument('--no_hub', action='store_true',
+                      help='send samples straight to the Arduino instead of through the hub\'s and the Pi\'s message handling')
+  parser.add_argument('--render_fps', type=int,
+                      default=100,
+                      help='frame rate of the LED renderer, as in raspi_client.py, or 0 to send each color as it arrives; with the renderer, latency runs until the LEDs reach the color (default: 100)')
+  parser.add_argument('--transition_time', type=float,
+                      default=0.25,
+                      help='seconds the renderer takes to ease to a new color (default: 0.25)')
+  parser.add_argument('--baud_rate', type=int,
+                      default=9600,
+                      help='baud rate of the real serial link, for comparison (default: 9600)')
+  return parser.parse_args()
+
+
+def main():
+  logging.basicConfig(level=logging.WARNING)
+  args = getArguments()
+
+  raspi_client.populateGammaTable()
+
+  if args.trace_file:
+    source = hardware_backends.TraceReplayBus(args.trace_file,
+                                              speed=args.replay_speed)
+  else:
+    source = hardware_backends.SimulatedTCS34725(
+        clock=hardware_backends.acceleratedClock(args.replay_speed))
+  # Replayed samples already arrive when they are due.
+  bus = FreshSampleBus(source, waitForSample=not args.trace_file)
+  raspi_client.openI2CBus(bus)
+
+  matcher = FrameMatcher()
+  fake_arduino = hardware_backends.FakeArduino(onFrame=matcher.onFrame)
+  fake_arduino.start()
+  raspi_client.arduino = serial.Serial(fake_arduino.port,
+                                       baudrate=args.baud_rate,
+                                       timeout=0,
+                                       writeTimeout=0)
+
+  if args.render_fps > 0:
+    raspi_client.renderer = led_renderer.LedRenderer(
+        raspi_client.writeToArduino,
+        fps=min(args.render_fps, int(led_renderer.maxFrameRate(args.baud_rate))),
+        transitionTime=args.transition_time)
+    render_thread = threading.Thread(target=raspi_client.renderer.run)
+    render_thread.daemon = True
+    render_thread.start()
+
+  start = time.time()
+  thread = threading.Thread(target=raspi_client.readI2CData,
+                            args=(bus, BenchFactory(matcher, not args.no_hub),
+                                  SENSOR_ID, args.poll_interval))
+  thread.daemon = True
+  thread.start()
+
+  if args.trace_file:
+    source.finished.wait()
+  else:
+    time.sleep(args.duration)
+  elapsed = time.time() - start
+  # Give the last frames time to come through the pseudo-terminal and the
+  # renderer.
+  time.sleep(0.1 + args.transition_time if args.render_fps > 0 else 0.1)
+
+  frames = len(fake_arduino.frames)
+  shown = len(matcher.latencies)
+  print 'samples read:      %d (%.1f/s)' % (bus.reads, bus.reads / elapsed)
+  print 'samples shown:     %d (%.1f/s)' % (shown, shown / elapsed)
+  print 'samples dropped:   %d' % matcher.dropped
+  print 'frames received:   %d (%.1f/s)' % (frames, frames / elapsed)
+  print 'serial budget:     %.1f frames/s at %d baud' % (
+      led_renderer.maxFrameRate(args.baud_rate), args.baud_rate)
+  for label, fraction in (('p50', 0.5), ('p90', 0.9), ('p99', 0.99)):
+    print 'latency %s:       %.3f ms' % (
+        label, percentile(matcher.latencies, fraction) * 1000)
+
+
+if __name__ == '__main__':
+  main()
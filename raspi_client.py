@@ -31,13 +31,15 @@
 ##
 ###############################################################################
 
-import RPi.GPIO as GPIO
 import argparse
-import json
+import color_protocol
+import hardware_backends
+import latency_trace
+import led_renderer
 import logging
 import math
+import sensor_array
 import serial
-import smbus
 import sys
 import threading
 import time
@@ -45,11 +47,28 @@ from autobahn import websocket
 from twisted.internet import reactor
 from twisted.python import log
 
+# The GPIO and I2C modules only exist on the Raspberry Pi. Elsewhere the
+# simulated or replayed sensor backends are used instead.
+try:
+  import RPi.GPIO as GPIO
+except ImportError:
+  GPIO = None
+try:
+  import smbus
+except ImportError:
+  smbus = None
+
 
 gamma_table = {}
 
 arduino_lock = threading.Lock()
 arduino = None
+arduino_port = '/dev/ttyACM0'
+arduino_baud_rate = 9600
+
+# Renders the LED colors at a fixed frame rate when set, in place of sending
+# each color to the Arduino as it arrives.
+renderer = None
 
 
 def populateGammaTable():
@@ -78,11 +97,12 @@ class DataClientProtocol(websocket.WebSocketClientProtocol):
        # keys.
        try:
          msg = validateData(msg)
-       except ValueError, e:
+       except color_protocol.ValidationError, e:
          logging.warning(e)
          return
        
        if msg:
+         latency_trace.stamp(msg, 'pi_receive')
          sendDataToArduino(msg)
 
 
@@ -119,35 +139,139 @@ class DataClientFactory(websocket.WebSocketClientFactory):
 
   def broadcast(self, msg):
     logging.info("broadcasting message: %s" % msg)
+    latency_trace.stamp(msg, 'uplink_enqueue')
     sendDataToArduino(msg)
     #if self.server is not None:
       #self.server.sendMessage(msg) # This is buggy...
 
 # Open I2C connection.
-def openI2CBus():
-  bus = smbus.SMBus(1)
+def openI2CBus(bus=None):
+  if bus is None:
+    bus = smbus.SMBus(1)
   # I2C address 0x29
-  # Register 0x12 has device ver. 
-  # Register addresses must be OR'ed with 0x80
-  bus.write_byte(0x29,0x80|0x12)
-  ver = bus.read_byte(0x29)
-  # version # should be 0x44
-  if ver == 0x44:
+  if sensor_array.setupSensor(bus, 0x29):
     logging.warning("Device found\n")
-    bus.write_byte(0x29, 0x80|0x00) # 0x00 = ENABLE register
-    bus.write_byte(0x29, 0x01|0x02) # 0x01 = Power on, 0x02 RGB sensors enabled
-    bus.write_byte(0x29, 0x80|0x0F) # 0x0F = control register for setting gain
-    bus.write_byte(0x29, 0x01)      # 0x01 = 4x gain
-    bus.write_byte(0x29, 0x80|0x01) # 0x01 = RGBC timing register
-    bus.write_byte(0x29, 0xEB)      # 256 - 21 = 0xEB (21 * 2.4 ms = 50 ms)
-    bus.write_byte(0x29, 0x80|0x14) # Reading results start register 14, LSB then MSB
     return bus
   else:
     logging.warning("Device not found\n")
 
 
+# Open the I2C bus with the given number on the Raspberry Pi.
+def openSMBus(number):
+  if smbus is None:
+    logging.error('smbus is not available, use --i2c_backend simulated '
+                  'or replay')
+    sys.exit(1)
+  return smbus.SMBus(number)
+
+
+# Pick the I2C bus backend chosen on the command line, optionally recording
+# the samples read from it, and set up the color sensor on it.
+def openI2CBackend(args):
+  if args.i2c_backend == 'simulated':
+    bus = hardware_backends.SimulatedTCS34725()
+  elif args.i2c_backend == 'replay':
+    bus = hardware_backends.TraceReplayBus(args.trace_file,
+                                           speed=args.replay_speed,
+                                           loop=True)
+  else:
+    bus = openSMBus(1)
+
+  if args.record_trace:
+    bus = hardware_backends.TraceRecordingBus(bus, args.record_trace)
+
+  return openI2CBus(bus)
+
+
+# Set up the sensors behind a multiplexer or on several buses, if any were
+# given on the command line. Returns the list of sensors, or None.
+def openSensorArray(args):
+  numbers = args.mux_channels or args.i2c_buses
+  if not numbers:
+    return None
+
+  if args.calibration:
+    calibrations = sensor_array.loadCalibrations(args.calibration,
+                                                 len(numbers))
+  else:
+    calibrations = [None] * len(numbers)
+
+  # Simulated sensors each start at a different hue, to tell them apart.
+  def simulatedSensor(i):
+    source = hardware_backends.hueCycleSource(phase=float(i) / len(numbers))
+    return hardware_backends.SimulatedTCS34725(colorSource=source)
+
+  sensors = []
+  if args.mux_channels:
+    if args.i2c_backend == 'simulated':
+      bus = hardware_backends.SimulatedTCA9548A(
+          dict((channel, simulatedSensor(i))
+               for i, channel in enumerate(numbers)),
+          address=args.mux_address)
+    else:
+      bus = openSMBus(1)
+    mux = sensor_array.I2CMultiplexer(bus, args.mux_address)
+    for channel, calibration in zip(numbers, calibrations):
+      sensors.append(sensor_array.ColorSensor(bus, mux, channel,
+                                              calibration=calibration))
+  else:
+    for i, number in enumerate(numbers):
+      if args.i2c_backend == 'simulated':
+        bus = simulatedSensor(i)
+      else:
+        bus = openSMBus(number)
+      sensors.append(sensor_array.ColorSensor(bus, channel=number,
+                                              calibration=calibrations[i]))
+
+  return sensors
+
+
+# Read all sensors of a sensor array, and every pollInterval seconds send the
+# hub their readings since the last message, averaged per sensor and fused
+# into one color, along with each sensor's own color if perSensor is set.
+def readSensorArray(sensors, factory, idString, pollInterval=0.5,
+                    perSensor=False):
+  def toColor(reading):
+    clear = reading[0]
+    red_i, green_i, blue_i = sensor_array.normalize(*reading)
+    return (gamma_table[red_i], gamma_table[green_i], gamma_table[blue_i],
+            min(65535, int(clear)))
+
+  def onBatch(readings, sampledAt):
+    fused = sensor_array.fuse(readings)
+    if fused is None:
+      return
+    red, green, blue, clear = toColor(fused)
+
+    colors = {
+      'red': red,
+      'green': green,
+      'blue': blue,
+      'clear': clear,
+      'id': idString
+    }
+    if perSensor:
+      colors['sensors'] = [list(toColor(reading)) if reading else None
+                           for reading in readings]
+    latency_trace.startTrace(colors, 'pi', 'sample', int(sampledAt * 1000000))
+
+    factory.broadcast(colors)
+
+  scheduler = sensor_array.SensorScheduler(sensors, onBatch,
+                                           batchInterval=pollInterval)
+  # Keep trying until every sensor answers, so a loose wire shows up in the
+  # log instead of silently leaving the Pi without sensor input.
+  while True:
+    try:
+      scheduler.run()
+      return
+    except IOError, e:
+      logging.error("Could not start the color sensors: %s" % e)
+      time.sleep(2)
+
+
 # Read I2C data.
-def readI2CData(i2c_input, factory, idString):
+def readI2CData(i2c_input, factory, idString, pollInterval=0.5):
   while True:
     try:
       data = i2c_input.read_i2c_block_data(0x29, 0)
@@ -155,6 +279,7 @@ def readI2CData(i2c_input, factory, idString):
       logging.warning("Could not read I2C data")
       time.sleep(0.5)
       continue
+    sampled_at = latency_trace.now()
 
     clear = data[1] << 8 | data[0]
     red_raw = data[3] << 8 | data[2]
@@ -192,10 +317,12 @@ def readI2CData(i2c_input, factory, idString):
       'clear': int(clear),
       'id': idString
     }
+    latency_trace.startTrace(colors, 'pi', 'sample', sampled_at)
 
     factory.broadcast(colors)
     #time.sleep(0.250)
-    time.sleep(0.50)
+    if pollInterval > 0:
+      time.sleep(pollInterval)
 
 
 def arduinoBackgroundConnector():
@@ -204,8 +331,8 @@ def arduinoBackgroundConnector():
     with arduino_lock:
       if arduino is None:
         try:
-          arduino = serial.Serial('/dev/ttyACM0',
-                                  baudrate=9600,
+          arduino = serial.Serial(arduino_port,
+                                  baudrate=arduino_baud_rate,
                                   bytesize=serial.EIGHTBITS,
                                   parity=serial.PARITY_NONE,
                                   stopbits=serial.STOPBITS_ONE,
@@ -217,43 +344,15 @@ def arduinoBackgroundConnector():
     time.sleep(1)
 
 
-# Validate data.
-def validateData(data):
-  # Check that data is in proper json format.
-  try:
-    obj = json.loads(data)
-  except ValueError:
-    raise ValueError, "Invalid json data: " + data
-
-  # Check object is dictionary.
-  if not isinstance(obj, dict):
-    raise ValueError, "Object is not a dictionary, but type %s" % type(obj)
-
-  # Validate desired keys in object.
-  keys = ('clear', 'red', 'green', 'blue')
-  missing_keys = []
-  for key in keys:
-    if key not in obj:
-      missing_keys.append(key)
-
-  if missing_keys:
-    raise ValueError, "Missing keys: %s" % missing_keys
-
-  # Validate values of desired keys are integers.
-  for key, value in obj.iteritems():
-    if key != 'id':
-      if not isinstance(value, int):
-        raise ValueError, "Value for %s is not an integer: %s. Its type: %s" % (key, value, type(value))
-
-  return obj
+# Validate data. Colors from the hub carry no clear value, so only the colors
+# themselves are required.
+validateData = color_protocol.validateColor
 
 
 def sendDataToArduino(data):
-  global arduino
-
   colors = {}
   for key, value in data.iteritems():
-    if key != 'id':
+    if key not in color_protocol.PASSTHROUGH_KEYS:
       colors[key] = value
   expected_colors = ('red', 'green', 'blue')
   for color in expected_colors:
@@ -261,11 +360,23 @@ def sendDataToArduino(data):
       logging.warning('missing color %s, not updating color' % color)
       return
 
+  if renderer is not None:
+    renderer.setTarget(colors['red'], colors['green'], colors['blue'],
+                       trace=data.get('trace'))
+    return
+
   logging.info('sending colors to Arduino: %s' % str(colors))
   message = ('\xFF\xFE' +
              chr(colors['red']) + chr(colors['green']) +
              chr(colors['blue']) +
              '\x00')
+  writeToArduino(message)
+  latency_trace.stamp(data, 'serial_write')
+
+
+# Write a frame to the Arduino, if it is connected.
+def writeToArduino(message):
+  global arduino
 
   with arduino_lock:
     if arduino is None:
@@ -276,7 +387,7 @@ def sendDataToArduino(data):
       written = arduino.write(message)
       if written < len(message):
         logging.warning('Wrote %d of %d bytes to Arduino.' %
-                        (written, len(written)))
+                        (written, len(message)))
     except serial.SerialTimeoutException, e:
       logging.warning('Write timeout writing to Arduino.')
     except serial.SerialException, e:
@@ -284,6 +395,11 @@ def sendDataToArduino(data):
       arduino = None
 
 
+# Parse a comma separated list of numbers.
+def parseIntList(value):
+  return [int(number) for number in value.split(',')]
+
+
 # Get input arguments.
 def getArguments():
   # Enable parsing of arguments for this script.
@@ -304,16 +420,72 @@ def getArguments():
   parser.add_argument('-b', '--blue_pin', type=int,
                       default=16,
                       help='number for blue channel on GPIO board as numbered by board numbering, not BCM numbering (default: 16)')
+  parser.add_argument('--i2c_backend',
+                      choices=('smbus', 'simulated', 'replay'),
+                      default='smbus',
+                      help='where color sensor data comes from: the sensor on I2C bus 1, a simulated sensor, or a recorded trace (default: smbus)')
+  parser.add_argument('--trace_file',
+                      help='sensor trace to play back with --i2c_backend replay')
+  parser.add_argument('--replay_speed', type=float,
+                      default=1.0,
+                      help='how many times faster than recorded to play back the trace (default: 1.0)')
+  parser.add_argument('--record_trace',
+                      help='file to record the sensor samples read into, for later replay')
+  parser.add_argument('--poll_interval', type=float,
+                      default=0.5,
+                      help='seconds to wait between sensor reads with one sensor, or between messages to the hub with several, each carrying the readings averaged since the last (default: 0.5)')
+  parser.add_argument('--mux_channels', type=parseIntList,
+                      help='comma separated TCA9548A multiplexer channels with a color sensor on each, e.g. 0,1,2,3 (default: one sensor, no multiplexer)')
+  parser.add_argument('--mux_address', type=lambda value: int(value, 0),
+                      default=0x70,
+                      help='I2C address of the multiplexer (default: 0x70)')
+  parser.add_argument('--i2c_buses', type=parseIntList,
+                      help='comma separated I2C bus numbers with a color sensor on each, instead of a multiplexer (default: one sensor on bus 1)')
+  parser.add_argument('--calibration',
+                      help='JSON file with a list of {"dark": [c, r, g, b], "gain": [r, g, b]} calibrations, one per sensor')
+  parser.add_argument('--sensor_output',
+                      choices=('fused', 'channels'),
+                      default='fused',
+                      help='send the hub one color fused from all sensors, or also each sensor\'s own color (default: fused)')
+  parser.add_argument('--serial_backend',
+                      choices=('serial', 'fake'),
+                      default='serial',
+                      help='send LED colors to the Arduino, or to a fake Arduino on a pseudo-terminal (default: serial)')
+  parser.add_argument('--serial_port',
+                      default='/dev/ttyACM0',
+                      help='serial port of the Arduino (default: /dev/ttyACM0)')
+  parser.add_argument('--render_fps', type=int,
+                      default=100,
+                      help='frames per second to render LED color transitions at, or 0 to send each color as it arrives (default: 100)')
+  parser.add_argument('--transition_time', type=float,
+                      default=0.25,
+                      help='seconds to ease from one color to the next (default: 0.25)')
+  parser.add_argument('--render_gamma', type=float,
+                      default=1.0,
+                      help='gamma correction applied to rendered frames; sensor colors are already corrected (default: 1.0)')
+  parser.add_argument('--latency_dump',
+                      default='raspi_latency.trace',
+                      help='file the latency trace is written to on SIGUSR1 (default: raspi_latency.trace)')
 
   args = parser.parse_args()
 
+  if args.i2c_backend == 'replay' and not args.trace_file:
+    parser.error('--i2c_backend replay requires --trace_file')
+  if args.mux_channels and args.i2c_buses:
+    parser.error('use either --mux_channels or --i2c_buses, not both')
+  if (args.mux_channels or args.i2c_buses) and args.i2c_backend == 'replay':
+    parser.error('trace replay only supports a single sensor')
+
   logging.info('WebSocket server at %s on port %d' % (args.address, args.port_number))
   logging.info('RGB channels at r: %d, g: %d, b: %d' % (args.red_pin, args.green_pin, args.blue_pin))
+  logging.info('Sensor backend %s, serial backend %s' % (args.i2c_backend, args.serial_backend))
 
   return args
 
 
 def main():
+  global arduino_port, renderer
+
   # Set up logging.
   _fmt = '%(asctime)s [%(levelname)s] %(name)s: %(message)s'
   logging.basicConfig(level=logging.DEBUG, format=_fmt)
@@ -330,8 +502,38 @@ def main():
   args = getArguments()
   serverPortURL = '%s:%d' % (args.address, args.port_number)
 
-  # Create connection to I2C Bus on the Raspberry Pi to read in sensor data.
-  i2c_input = openI2CBus()
+  # Write the latency trace to a file on SIGUSR1.
+  latency_trace.installDumpHandler(args.latency_dump)
+
+  # Create connection to I2C Bus on the Raspberry Pi to read in sensor data,
+  # or to the simulated or replayed sensor chosen instead. Several sensors
+  # are read by a scheduler of their own.
+  sensors = openSensorArray(args)
+  if sensors is None:
+    i2c_input = openI2CBackend(args)
+
+  # Stand in a pseudo-terminal for the Arduino if asked to.
+  arduino_port = args.serial_port
+  if args.serial_backend == 'fake':
+    fake_arduino = hardware_backends.FakeArduino()
+    fake_arduino.start()
+    arduino_port = fake_arduino.port
+
+  # Render color transitions at a fixed frame rate, within what the serial
+  # link to the Arduino can carry.
+  if args.render_fps > 0:
+    fps = args.render_fps
+    max_fps = led_renderer.maxFrameRate(arduino_baud_rate)
+    if fps > max_fps:
+      logging.warning('%d fps is more than %d baud can carry, using %d fps' %
+                      (fps, arduino_baud_rate, max_fps))
+      fps = int(max_fps)
+    renderer = led_renderer.LedRenderer(writeToArduino, fps=fps,
+                                        transitionTime=args.transition_time,
+                                        gamma=args.render_gamma)
+    render_thread = threading.Thread(target=renderer.run)
+    render_thread.daemon = True
+    render_thread.start()
 
   # Create factory.
   factory = DataClientFactory(serverPortURL, debug = True)
@@ -345,7 +547,15 @@ def main():
   arduino_thread.start()
 
   # Create one more thread. There's a main thread already.
-  thread = threading.Thread(target=readI2CData, args=(i2c_input, factory, idForRPi))
+  if sensors is None:
+    thread = threading.Thread(target=readI2CData,
+                              args=(i2c_input, factory, idForRPi,
+                                    args.poll_interval))
+  else:
+    thread = threading.Thread(target=readSensorArray,
+                              args=(sensors, factory, idForRPi,
+                                    args.poll_interval,
+                                    args.sensor_output == 'channels'))
   thread.daemon = True
   thread.start()
 
@@ -0,0 +1,268 @@
+###############################################################################
+## Reads several TCS34725 color sensors on the Raspberry Pi, either behind a
+## TCA9548A I2C multiplexer or on separate I2C buses.
+##
+## A sensor integrates light on its own and only needs the bus to hand over
+## the finished sample, so the sensors are started a fraction of an
+## integration window apart and each one is read just after its window
+## completes. The reads are spread evenly over the window, every sensor is
+## read at its full rate, and adding sensors adds samples instead of slowing
+## the others down.
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+import json
+import logging
+import time
+
+
+TCS34725_ADDRESS = 0x29
+TCA9548A_ADDRESS = 0x70
+
+# 256 - 21 = 0xEB (21 * 2.4 ms = 50 ms)
+DEFAULT_ATIME = 0xEB
+
+# How long after its window completes a sensor is read, to allow for its
+# clock running a little slow.
+READ_MARGIN = 0.002
+
+
+# Integration window set by an RGBC timing register value, in seconds.
+def integrationTime(atime):
+  return (256 - atime) * 0.0024
+
+
+# Check the device on bus at address is a TCS34725 and start it integrating.
+# Returns True if the device was found.
+def setupSensor(bus, address=TCS34725_ADDRESS, atime=DEFAULT_ATIME):
+  # Register 0x12 has device ver.
+  # Register addresses must be OR'ed with 0x80
+  bus.write_byte(address, 0x80|0x12)
+  ver = bus.read_byte(address)
+  # version # should be 0x44
+  if ver != 0x44:
+    return False
+  bus.write_byte(address, 0x80|0x00) # 0x00 = ENABLE register
+  bus.write_byte(address, 0x01|0x02) # 0x01 = Power on, 0x02 RGB sensors enabled
+  bus.write_byte(address, 0x80|0x0F) # 0x0F = control register for setting gain
+  bus.write_byte(address, 0x01)      # 0x01 = 4x gain
+  bus.write_byte(address, 0x80|0x01) # 0x01 = RGBC timing register
+  bus.write_byte(address, atime)
+  bus.write_byte(address, 0x80|0x14) # Reading results start register 14, LSB then MSB
+  return True
+
+
+# Read per-sensor calibrations from a JSON file holding a list with one entry
+# per sensor, like {"dark": [clear, red, green, blue], "gain": [red, green,
+# blue]}. Missing entries or fields leave a sensor uncalibrated.
+def loadCalibrations(path, count):
+  with open(path) as f:
+    entries = json.load(f)
+  calibrations = []
+  for i in range(count):
+    entry = entries[i] if i < len(entries) else {}
+    calibrations.append(Calibration(entry.get('dark', (0, 0, 0, 0)),
+                                    entry.get('gain', (1.0, 1.0, 1.0))))
+  return calibrations
+
+
+class Calibration(object):
+  """
+  Corrections for one sensor: dark counts subtracted from the raw clear,
+  red, green and blue readings, then gains applied to red, green and blue so
+  that white reads as white.
+  """
+
+  def __init__(self, dark=(0, 0, 0, 0), gain=(1.0, 1.0, 1.0)):
+    self.dark = tuple(dark)
+    self.gain = tuple(gain)
+
+  def apply(self, clear, red, green, blue):
+    dark = self.dark
+    gain = self.gain
+    return (max(0, clear - dark[0]),
+            max(0.0, (red - dark[1]) * gain[0]),
+            max(0.0, (green - dark[2]) * gain[1]),
+            max(0.0, (blue - dark[3]) * gain[2]))
+
+
+class I2CMultiplexer(object):
+  """
+  TCA9548A I2C multiplexer. Only switches channels when the next device is
+  on a different one.
+  """
+
+  def __init__(self, bus, address=TCA9548A_ADDRESS):
+    self.bus = bus
+    self.address = address
+    self.channel = None
+
+  def select(self, channel):
+    if channel != self.channel:
+      self.bus.write_byte(self.address, 1 << channel)
+      self.channel = channel
+
+
+class ColorSensor(object):
+  """
+  One TCS34725, on its own bus or on a channel of a multiplexer. read()
+  returns its calibrated (clear, red, green, blue) counts.
+  """
+
+  def __init__(self, bus, mux=None, channel=None, address=TCS34725_ADDRESS,
+               calibration=None):
+    self.bus = bus
+    self.mux = mux
+    self.channel = channel
+    self.address = address
+    self.calibration = calibration or Calibration()
+
+  def name(self):
+    if self.mux is not None:
+      return 'multiplexer channel %d' % self.channel
+    return 'bus %s' % self.channel
+
+  def _select(self):
+    if self.mux is not None:
+      self.mux.select(self.channel)
+
+  def setup(self, atime=DEFAULT_ATIME):
+    self._select()
+    return setupSensor(self.bus, self.address, atime)
+
+  def read(self):
+    self._select()
+    data = self.bus.read_i2c_block_data(self.address, 0x80|0x14)
+    clear = data[1] << 8 | data[0]
+    red = data[3] << 8 | data[2]
+    green = data[5] << 8 | data[4]
+    blue = data[7] << 8 | data[6]
+    return self.calibration.apply(clear, red, green, blue)
+
+
+class SensorScheduler(object):
+  """
+  Reads a set of sensors with their integration windows interleaved, and
+  hands their readings to onBatch(readings, sampledAt) at most once every
+  batchInterval seconds. Every read counts: readings has one (clear, red,
+  green, blue) entry per sensor, averaged over all of that sensor's reads
+  since the last batch, or None for a sensor that could not be read once.
+  sampledAt is when the first of those reads was taken.
+  """
+
+  def __init__(self, sensors, onBatch, atime=DEFAULT_ATIME, batchInterval=0):
+    self.sensors = sensors
+    self.onBatch = onBatch
+    self.atime = atime
+    self.window = integrationTime(atime)
+    self.batchInterval = batchInterval
+    self.running = False
+
+  # Start the sensors a window / len(sensors) apart. Returns the time each
+  # one's first window completes, or raises IOError if a sensor is missing.
+  def start(self):
+    stagger = self.window / len(self.sensors)
+    deadlines = []
+    startedAt = time.time()
+    for i, sensor in enumerate(self.sensors):
+      delay = startedAt + i * stagger - time.time()
+      if delay > 0:
+        time.sleep(delay)
+      if not sensor.setup(self.atime):
+        raise IOError('No color sensor on %s' % sensor.name())
+      deadlines.append(time.time() + self.window + READ_MARGIN)
+    return deadlines
+
+  # Read the sensors until stop() is called. Raises IOError if a sensor
+  # cannot be set up.
+  def run(self):
+    self.running = True
+    deadlines = self.start()
+    sums = [[0, 0.0, 0.0, 0.0] for sensor in self.sensors]
+    counts = [0] * len(self.sensors)
+    lastBatch = time.time()
+    sampledAt = None
+    while self.running:
+      # Sensors were started in order, so they come due round robin.
+      for i, sensor in enumerate(self.sensors):
+        delay = deadlines[i] - time.time()
+        if delay > 0:
+          time.sleep(delay)
+        try:
+          reading = sensor.read()
+        except IOError:
+          logging.warning('Could not read color sensor on %s' % sensor.name())
+          reading = None
+        if sampledAt is None:
+          sampledAt = time.time()
+        if reading is not None:
+          total = sums[i]
+          for n in range(4):
+            total[n] += reading[n]
+          counts[i] += 1
+        deadlines[i] += self.window
+        # A read that ran very late skips the windows it missed.
+        while deadlines[i] < time.time():
+          deadlines[i] += self.window
+
+      now = time.time()
+      if now - lastBatch >= self.batchInterval:
+        lastBatch = now
+        readings = [average(total, count) for total, count in zip(sums, counts)]
+        self.onBatch(readings, sampledAt)
+        sums = [[0, 0.0, 0.0, 0.0] for sensor in self.sensors]
+        counts = [0] * len(self.sensors)
+        sampledAt = None
+
+  def stop(self):
+    self.running = False
+
+
+# Average of count readings summed into total, as (clear, red, green, blue),
+# or None if there were none.
+def average(total, count):
+  if count == 0:
+    return None
+  count = float(count)
+  return (int(total[0] / count), total[1] / count, total[2] / count,
+          total[3] / count)
+
+
+# Scale calibrated counts to 0-255 colors relative to their clear count, as
+# readI2CData() does for a single sensor. Returns (red, green, blue).
+def normalize(clear, red, green, blue):
+  if clear <= 0:
+    return (0, 0, 0)
+  return tuple(min(255, int(value / float(clear) * 255))
+               for value in (red, green, blue))
+
+
+# Combine readings from several sensors into one (clear, red, green, blue),
+# weighting each sensor by how much light it saw.
+def fuse(readings):
+  clear = red = green = blue = 0
+  count = 0
+  for reading in readings:
+    if reading is None:
+      continue
+    clear += reading[0]
+    red += reading[1]
+    green += reading[2]
+    blue += reading[3]
+    count += 1
+  if count == 0:
+    return None
+  count = float(count)
+  return (int(clear / count), red / count, green / count, blue / count)
@@ -0,0 +1,206 @@
+###############################################################################
+## Serves the audience webpage (nunway_website) from the hub server, on the
+## same port as the websocket.
+##
+## Every file in the site directory is read into memory when the hub starts,
+## along with gzip and, if the brotli module is installed, brotli compressed
+## copies. Responses carry a strong ETag, so a browser revalidating an asset
+## it already has gets a 304 with no body. Pages have the assets they refer to
+## rewritten as assets/js/ws_client.js?v=<content hash>, and requests for such
+## versioned URLs are cached by the browser for a year without revalidating.
+## Pages also get a <meta name="hub-served"> tag, which tells ws_client.js
+## to open its websocket on the host the page came from.
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import posixpath
+import re
+from cStringIO import StringIO
+from twisted.web import resource
+
+# Brotli is optional; without it only gzip copies are kept.
+try:
+  import brotli
+except ImportError:
+  brotli = None
+
+
+# Cache-Control for versioned URLs, whose content never changes, and for all
+# other URLs, which browsers have to revalidate with their ETag.
+VERSIONED_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+UNVERSIONED_CACHE_CONTROL = 'no-cache'
+
+# Compressed copies are only kept if they save at least this much.
+MIN_COMPRESSION_RATIO = 0.9
+
+# Relative links in pages that may point at assets.
+LINK_PATTERN = re.compile(r'''((?:src|href)\s*=\s*["'])([^"'?#:]+)(["'])''')
+
+# Marker added to the head of every page served by the hub.
+HUB_SERVED_MARKER = '<meta name="hub-served" content="1">'
+HEAD_PATTERN = re.compile(r'<head(\s[^>]*)?>', re.IGNORECASE)
+
+
+def gzipCompress(body):
+  out = StringIO()
+  # mtime is fixed so the compressed copy, and its ETag, only depend on body.
+  compressor = gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9, mtime=0)
+  compressor.write(body)
+  compressor.close()
+  return out.getvalue()
+
+
+class StaticAsset(object):
+  """
+  One file of the site held in memory, with its compressed copies. variants
+  maps each content coding ('br', 'gzip' or 'identity') to the body and
+  ETag to serve for it.
+  """
+
+  def __init__(self, body, contentType):
+    self.contentType = contentType
+    self.version = hashlib.sha1(body).hexdigest()[:12]
+    self.variants = {'identity': (body, '"%s"' % self.version)}
+
+    compressors = [('gzip', gzipCompress)]
+    if brotli is not None:
+      compressors.insert(0, ('br', brotli.compress))
+    for coding, compress in compressors:
+      compressed = compress(body)
+      if len(compressed) < len(body) * MIN_COMPRESSION_RATIO:
+        self.variants[coding] = (compressed,
+                                 '"%s-%s"' % (self.version, coding))
+
+  # Pick the best coding the client accepts.
+  def negotiate(self, acceptEncoding):
+    accepted = set()
+    for part in acceptEncoding.split(','):
+      fields = part.split(';')
+      quality = 1.0
+      for field in fields[1:]:
+        name, _, value = field.partition('=')
+        if name.strip().lower() == 'q':
+          try:
+            quality = float(value)
+          except ValueError:
+            quality = 0.0
+      if quality > 0:
+        accepted.add(fields[0].strip().lower())
+    for coding in ('br', 'gzip'):
+      if coding in self.variants and (coding in accepted or '*' in accepted):
+        return coding
+    return 'identity'
+
+
+class StaticSite(resource.Resource):
+  """
+  Serves a directory from memory. Websocket upgrade requests are handed to
+  wsResource, so the page and the websocket share one port.
+  """
+
+  isLeaf = True
+
+  def __init__(self, directory, wsResource=None, index='index.html'):
+    resource.Resource.__init__(self)
+    self.wsResource = wsResource
+    self.index = index
+    self.assets = {}
+    self._load(directory)
+
+  def _load(self, directory):
+    files = {}
+    for root, dirs, names in os.walk(directory):
+      for name in names:
+        path = os.path.join(root, name)
+        url = os.path.relpath(path, directory).replace(os.sep, '/')
+        with open(path, 'rb') as f:
+          files[url] = f.read()
+
+    # Pages are loaded last so the assets they link to already have versions.
+    pages = [url for url in files if url.endswith(('.html', '.htm'))]
+    for url, body in files.items():
+      if url not in pages:
+        self.assets[url] = StaticAsset(body, self._contentType(url))
+    for url in pages:
+      body = self._markHubServed(self._versionLinks(url, files[url]))
+      self.assets[url] = StaticAsset(body, self._contentType(url))
+
+  def _contentType(self, url):
+    contentType = mimetypes.guess_type(url)[0] or 'application/octet-stream'
+    if contentType.startswith('text/') or contentType.endswith('javascript'):
+      contentType += '; charset=utf-8'
+    return contentType
+
+  # Add ?v=<content hash> to links in a page that point at known assets.
+  def _versionLinks(self, pageUrl, body):
+    base = posixpath.dirname(pageUrl)
+    def version(match):
+      link = match.group(2)
+      asset = self.assets.get(posixpath.normpath(posixpath.join(base, link)))
+      if asset is None:
+        return match.group(0)
+      return '%s%s?v=%s%s' % (match.group(1), link, asset.version,
+                              match.group(3))
+    return LINK_PATTERN.sub(version, body)
+
+  # Insert HUB_SERVED_MARKER at the start of a page's head, before any script
+  # that looks for it.
+  def _markHubServed(self, body):
+    return HEAD_PATTERN.sub(lambda match: match.group(0) + HUB_SERVED_MARKER,
+                            body, count=1)
+
+  def render(self, request):
+    upgrade = request.getHeader('upgrade') or ''
+    if self.wsResource is not None and upgrade.lower() == 'websocket':
+      return self.wsResource.render(request)
+
+    if request.method not in ('GET', 'HEAD'):
+      request.setResponseCode(405)
+      request.setHeader('allow', 'GET, HEAD')
+      return ''
+
+    url = request.path.lstrip('/')
+    if url == '' or url.endswith('/'):
+      url += self.index
+    asset = self.assets.get(url)
+    if asset is None:
+      return resource.NoResource().render(request)
+
+    coding = asset.negotiate(request.getHeader('accept-encoding') or '')
+    body, etag = asset.variants[coding]
+
+    if request.args.get('v', [None])[0] == asset.version:
+      request.setHeader('cache-control', VERSIONED_CACHE_CONTROL)
+    else:
+      request.setHeader('cache-control', UNVERSIONED_CACHE_CONTROL)
+    request.setHeader('etag', etag)
+    request.setHeader('vary', 'Accept-Encoding')
+
+    ifNoneMatch = request.getHeader('if-none-match')
+    if ifNoneMatch is not None:
+      tags = [tag.strip() for tag in ifNoneMatch.split(',')]
+      if etag in tags or '*' in tags:
+        request.setResponseCode(304)
+        return ''
+
+    request.setHeader('content-type', asset.contentType)
+    if coding != 'identity':
+      request.setHeader('content-encoding', coding)
+    request.setHeader('content-length', str(len(body)))
+    return body
@@ -0,0 +1,144 @@
+###############################################################################
+## Voting model for the hub server. Each audience member's vote is a color,
+## and the decided color is the most popular one rather than the average of
+## all votes, which tends towards a muddy brown.
+##
+## Votes are counted in a histogram of quantized colors. The bins are also
+## kept sorted by count, and since a vote only ever moves a bin's count up or
+## down by one, keeping them sorted takes a single swap. Adding, changing or
+## removing a vote is O(1), the mode is O(1) and the top k bins are O(k), no
+## matter how many people are voting.
+##
+##  Licensed under the Apache License, Version 2.0 (the "License");
+##  you may not use this file except in compliance with the License.
+##  You may obtain a copy of the License at
+##
+##      http://www.apache.org/licenses/LICENSE-2.0
+##
+##  Unless required by applicable law or agreed to in writing, software
+##  distributed under the License is distributed on an "AS IS" BASIS,
+##  WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+##  See the License for the specific language governing permissions and
+##  limitations under the License.
+##
+###############################################################################
+
+
+class ColorHistogram(object):
+  """
+  Histogram of votes over RGB colors quantized to bitsPerChannel bits per
+  channel, 4096 bins with the default of 4 bits.
+
+  order lists every bin from the highest count to the lowest, position is
+  the index of each bin in order, and blockStart and blockEnd give the range
+  of order holding the bins with each count that has any. Each bin also sums
+  the exact colors voted into it, so the color reported for a bin is the
+  average of its votes rather than the bin's corner.
+  """
+
+  def __init__(self, bitsPerChannel=4):
+    self.bits = bitsPerChannel
+    self.shift = 8 - bitsPerChannel
+    size = 1 << (3 * bitsPerChannel)
+    self.counts = [0] * size
+    self.order = list(range(size))
+    self.position = list(range(size))
+    self.blockStart = {0: 0}
+    self.blockEnd = {0: size - 1}
+    self.redSums = [0] * size
+    self.greenSums = [0] * size
+    self.blueSums = [0] * size
+    self.voterColors = {}
+
+  def __len__(self):
+    return len(self.voterColors)
+
+  def binFor(self, red, green, blue):
+    return (((red >> self.shift) << (2 * self.bits)) |
+            ((green >> self.shift) << self.bits) |
+            (blue >> self.shift))
+
+  # Record voter's vote, replacing any vote they made before.
+  def vote(self, voter, red, green, blue):
+    previous = self.voterColors.get(voter)
+    if previous is not None:
+      self._remove(*previous)
+    self._add(red, green, blue)
+    self.voterColors[voter] = (red, green, blue)
+
+  # Take back voter's vote, if they made one.
+  def removeVoter(self, voter):
+    previous = self.voterColors.pop(voter, None)
+    if previous is not None:
+      self._remove(*previous)
+
+  # Most voted color as (red, green, blue, votes), or None without votes.
+  def mode(self):
+    top = self.topK(1)
+    if top:
+      return top[0]
+    return None
+
+  # Up to k most voted colors as (red, green, blue, votes), most votes first.
+  def topK(self, k):
+    colors = []
+    for i in range(min(k, len(self.order))):
+      bin = self.order[i]
+      count = self.counts[bin]
+      if count == 0:
+        break
+      colors.append((self.redSums[bin] // count,
+                     self.greenSums[bin] // count,
+                     self.blueSums[bin] // count,
+                     count))
+    return colors
+
+  def _add(self, red, green, blue):
+    bin = self.binFor(red, green, blue)
+    self._increment(bin)
+    self.redSums[bin] += red
+    self.greenSums[bin] += green
+    self.blueSums[bin] += blue
+
+  def _remove(self, red, green, blue):
+    bin = self.binFor(red, green, blue)
+    self._decrement(bin)
+    self.redSums[bin] -= red
+    self.greenSums[bin] -= green
+    self.blueSums[bin] -= blue
+
+  # Move the bin to the front of its count's block, then into the block above.
+  def _increment(self, bin):
+    count = self.counts[bin]
+    first = self.blockStart[count]
+    self._swap(self.position[bin], first)
+    if first == self.blockEnd[count]:
+      del self.blockStart[count]
+      del self.blockEnd[count]
+    else:
+      self.blockStart[count] = first + 1
+    self.blockEnd[count + 1] = first
+    if count + 1 not in self.blockStart:
+      self.blockStart[count + 1] = first
+    self.counts[bin] = count + 1
+
+  # Move the bin to the back of its count's block, then into the block below.
+  def _decrement(self, bin):
+    count = self.counts[bin]
+    last = self.blockEnd[count]
+    self._swap(self.position[bin], last)
+    if last == self.blockStart[count]:
+      del self.blockStart[count]
+      del self.blockEnd[count]
+    else:
+      self.blockEnd[count] = last - 1
+    self.blockStart[count - 1] = last
+    if count - 1 not in self.blockEnd:
+      self.blockEnd[count - 1] = last
+    self.counts[bin] = count - 1
+
+  def _swap(self, i, j):
+    order = self.order
+    order[i], order[j] = order[j], order[i]
+    self.position[order[i]] = i
+    self.position[order[j]] = j